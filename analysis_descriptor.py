@@ -1,36 +1,184 @@
 import os
-import json
+import re
+import bisect
+import functools
+import asyncio
 import logging
-from typing import Dict, Any, Optional
-from openai import OpenAI
+from collections import OrderedDict
+from typing import ClassVar, Dict, Any, List, Literal, Optional, Tuple
+import orjson
 
 logger = logging.getLogger(__name__)
 
+# ChatGPT応答キャッシュの最大件数
+DESCRIPTION_CACHE_SIZE = 1024
+
+# 説明（linguistic_description）の項目名
+DESCRIPTION_FIELDS = ("overview", "shape_features", "shoe_advice", "health_notes", "full_description")
+
+# ChatGPT応答のセクション見出しキーワード
+SECTION_KEYWORDS = ("全体的", "形状", "靴選び", "健康")
+_SECTION_RE = re.compile("|".join(map(re.escape, SECTION_KEYWORDS)))
+# キーワードを含む行を見出し行として一度に走査する
+_HEADERS_RE = re.compile(r"^.*(?:" + _SECTION_RE.pattern + r").*$", re.M)
+
+# ChatGPTへ渡す測定データ要約のテンプレート
+_DATA_SUMMARY_FIELDS = ('foot_length', 'foot_width', 'circumference', 'dorsum_height_50', 'ahi', 'point_count')
+_DATA_SUMMARY_TPL = """
+足の測定結果:
+- 足長: %s cm
+- 足幅: %s cm
+- 足囲: %s cm
+- 甲高(50%%位置): %s cm
+- AHI指数: %s
+- 点群数: %s 点
+"""
+
+# ダミー説明（full_description）のテンプレート
+_DUMMY_FULL_DESCRIPTION_TPL = """
+【足の測定結果分析】
+
+■ 全体的な特徴
+足長: %.1fcm (%s)
+足幅: %.1fcm (%s、足長比%.1f%%)
+足囲: %.1fcm
+甲高: %.1fcm (足長比%.1f%%)
+AHI指数: %.1f
+
+■ 形状の特徴
+%s
+%s
+
+■ 靴選びのアドバイス
+【サイズ】%s
+【幅・ワイズ】%s
+【推奨事項】
+- 試着は午後に行う（足が膨らんだ状態で確認）
+- つま先に1-1.5cmのゆとりを確保
+- かかとがしっかりフィットすることを確認
+- 歩行時の足の動きを考慮してサイズを選択
+
+■ 健康面での注意点
+%s
+- 定期的な足のマッサージとストレッチを実施
+- 長時間同じ靴を履き続けない
+- 足の変化に応じて定期的にサイズを見直す
+- 痛みや違和感がある場合は早めに専門医に相談
+"""
+
 class FootAnalysisDescriptor:
     """足の解析結果を自然言語で説明するクラス"""
     
-    def __init__(self, api_key: Optional[str] = None):
+    # 分析の観点と測定値の基準（単体・一括の両プロンプトで共通）
+    _ANALYSIS_GUIDELINES: ClassVar[str] = """1. 全体的な足の特徴（測定値を基準とした客観的評価）
+2. 足の形状の特徴（数値的根拠に基づく分析）
+3. 靴選びのアドバイス（具体的なワイズ、サイズ、ブランド推奨含む）
+4. 健康面での注意点（足の形状に基づく具体的なケア方法）
+
+測定値の基準:
+- 足長: 日本人平均 男性25.5cm、女性23.5cm
+- 足幅: 標準的な比率は足長の約40-42%
+- 足囲: 標準的な比率は足長の約90-95%
+- 甲高: 標準的な比率は足長の約25-28%
+- AHI指数: 250-300が標準的"""
+    
+    _SYSTEM_PROMPT: ClassVar[str] = f"""あなたは足の測定データを分析する専門家です。
+足の測定結果を受け取り、以下の観点から分析して具体的で実用的な日本語アドバイスを提供してください：
+
+{_ANALYSIS_GUIDELINES}
+
+具体的な数値を用いて、実用的で行動可能なアドバイスを提供してください。
+出力はJSONオブジェクトとし、"overview"（全体的な特徴）, "shape_features"（形状の特徴）, "shoe_advice"（靴選びのアドバイス）, "health_notes"（健康面での注意点）, "full_description"（全体をまとめた説明文）のキーを持ち、各値は文字列とすること。"""
+    
+    _BATCH_SYSTEM_PROMPT: ClassVar[str] = f"""あなたは足の測定データを分析する専門家です。
+番号付きで複数の足の測定結果を受け取り、それぞれについて以下の観点から分析して具体的で実用的な日本語アドバイスを提供してください：
+
+{_ANALYSIS_GUIDELINES}
+
+出力は {{"analyses": [...]}} 形式のJSONオブジェクトとし、配列には入力と同じ順序で全件の要素を含めてください。
+各要素は "overview", "shape_features", "shoe_advice", "health_notes", "full_description" のキーを持ち、各値は文字列とすること。"""
+    
+    # リクエストごとに再構築しないシステムメッセージ
+    _SYSTEM_MSG: ClassVar[Dict[str, str]] = {"role": "system", "content": _SYSTEM_PROMPT}
+    _BATCH_SYSTEM_MSG: ClassVar[Dict[str, str]] = {"role": "system", "content": _BATCH_SYSTEM_PROMPT}
+    
+    # ダミー説明の分類表（閾値より大きい場合に次の行を選択: bisect_left）
+    # 足長: (分類, 靴サイズ, 足長への加算値, アドバイス)
+    _SIZE_BINS: ClassVar[Tuple[float, ...]] = (24.0, 27.0)
+    _SIZE_ROWS: ClassVar[Tuple[Tuple[str, str, float, str], ...]] = (
+        ("小さめ", "{0:.1f}cm程度", 0.5, "足長{foot_length:.1f}cmは小さめです。靴のサイズは{shoe_size}をお選びください。フィット感を重視してください。"),
+        ("標準的", "{0:.1f}cm程度", 1.0, "足長{foot_length:.1f}cmは標準的です。靴のサイズは{shoe_size}が適しています。"),
+        ("大きめ", "27.5cm以上", 0.0, "足長{foot_length:.1f}cmは大きめです。靴のサイズは{shoe_size}をお選びください。つま先に1-1.5cm程度のゆとりを確保してください。"),
+    )
+    # 足長比の足幅(%): (分類, アドバイス)
+    _WIDTH_BINS: ClassVar[Tuple[float, ...]] = (38.0, 42.0)
+    _WIDTH_ROWS: ClassVar[Tuple[Tuple[str, str], ...]] = (
+        ("幅狭", "足幅{foot_width:.1f}cm（足長比{width_ratio:.1f}%）は幅狭です。D〜Eワイズの靴をお選びください。海外ブランドも選択肢に入ります。"),
+        ("標準", "足幅{foot_width:.1f}cm（足長比{width_ratio:.1f}%）は標準的です。E〜2Eワイズの靴が適しています。"),
+        ("幅広", "足幅{foot_width:.1f}cm（足長比{width_ratio:.1f}%）は幅広です。3E〜4Eワイズの靴がお勧めです。アシックス、ミズノなどの日本ブランドが適しています。"),
+    )
+    # 足長比の甲高(%): 分析文
+    _HEIGHT_BINS: ClassVar[Tuple[float, ...]] = (25.0, 28.0)
+    _HEIGHT_ROWS: ClassVar[Tuple[str, ...]] = (
+        "甲高{dorsum_height:.1f}cm（足長比{height_ratio:.1f}%）は低めです。フィット感の良い靴や薄型インソールの使用をお勧めします。",
+        "甲高{dorsum_height:.1f}cm（足長比{height_ratio:.1f}%）は標準的です。一般的な靴で問題ありません。",
+        "甲高{dorsum_height:.1f}cm（足長比{height_ratio:.1f}%）は高めです。甲部分にゆとりのある靴や調整可能な紐靴をお選びください。",
+    )
+    # AHI指数: (分析文, 健康面のアドバイス)
+    _AHI_BINS: ClassVar[Tuple[float, ...]] = (250.0, 300.0)
+    _AHI_ROWS: ClassVar[Tuple[Tuple[str, str], ...]] = (
+        ("AHI指数{ahi:.1f}は低めで、甲が薄い特徴があります。", "足のサポートを強化するため、適切なインソールの使用を検討してください。"),
+        ("AHI指数{ahi:.1f}は標準的で、バランスの良い足型です。", "標準的な足型なので、一般的な靴選びの指標に従ってください。"),
+        ("AHI指数{ahi:.1f}は高めで、甲が高い特徴があります。", "甲の圧迫を避けるため、調整可能な靴紐の靴を選び、きつく締めすぎないよう注意してください。"),
+    )
+    
+    # 単位変換の対象となる長さの測定項目
+    _LENGTH_FIELDS: ClassVar[Tuple[str, ...]] = ('foot_length', 'foot_width', 'circumference', 'dorsum_height_50')
+    
+    def __init__(self, api_key: Optional[str] = None, *, units: Literal["mm", "cm"] = "cm", model: str = "gpt-5-mini"):
         """
         初期化
         
         Args:
             api_key: OpenAI APIキー。Noneの場合は環境変数から取得
+            units: 入力される長さの単位（内部ではセンチメートルで扱う）
+            model: 使用するChatGPTのモデル名
         """
+        if units not in ("mm", "cm"):
+            raise ValueError(f"Unsupported units: {units}")
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.units = units
+        self.model = model
         self.client = None
-
+        # 同時実行数の上限（アカウントのRPM枠に合わせて環境変数で調整）
+        # 上限はアカウント全体の値として扱い、サーバーワーカー間で分け合う
+        max_concurrency = int(os.getenv("OPENAI_MAX_CONCURRENCY", "20"))
+        self._sem = asyncio.Semaphore(max(1, max_concurrency // int(os.getenv("WEB_CONCURRENCY", "1"))))
+        self._max_retries = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+        # 丸めた測定値をキーとするChatGPT応答のLRUキャッシュ
+        self._description_cache: "OrderedDict[Tuple, Dict[str, str]]" = OrderedDict()
         
         if self.api_key:
             try:
-                self.client = OpenAI(api_key=self.api_key)
+                # openaiの読み込みはAPIキーがある場合のみ行う
+                from openai import AsyncOpenAI
+                self.client = AsyncOpenAI(api_key=self.api_key)
                 logger.info("OpenAI client initialized successfully")
             except Exception as e:
                 logger.warning(f"Failed to initialize OpenAI client: {e}")
                 self.client = None
         else:
             logger.warning("No OpenAI API key provided, will use dummy responses")
+        
+        # 説明生成の経路は初期化時に一度だけ決定する
+        self._describe = self._describe_with_chatgpt if self.client else self._describe_with_dummy
     
-    def analyze_foot_measurements(self, measurements: Dict[str, Any]) -> Dict[str, Any]:
+    async def aclose(self):
+        """OpenAIクライアントのHTTP接続プールを閉じる"""
+        if self.client:
+            await self.client.close()
+    
+    async def analyze_foot_measurements(self, measurements: Dict[str, Any]) -> Dict[str, Any]:
         """
         足の測定結果を分析して自然言語の説明を生成
         
@@ -38,120 +186,262 @@ class FootAnalysisDescriptor:
             measurements: 足の測定データ
         
         Returns:
-            dict: 解析結果と自然言語説明
+            dict: 解析結果と自然言語説明（cacheableは同じ測定値に同じ説明を返してよいか）
         """
+        # 説明の生成はセンチメートル単位の値で行う
+        description, source, cacheable = await self._describe(self._to_cm(measurements))
+        return {
+            "success": True,
+            "numerical_analysis": measurements,
+            "linguistic_description": description,
+            "analysis_source": source,
+            "cacheable": cacheable
+        }
+    
+    async def _describe_with_chatgpt(self, measurements: Dict[str, Any]) -> Tuple[Dict[str, str], str, bool]:
+        """ChatGPTで説明を生成（API失敗時のみダミーにフォールバック）"""
+        from openai import OpenAIError
+        
         try:
-            # ChatGPTが利用可能な場合
-            if self.client:
-                try:
-                    description = self._get_chatgpt_description(measurements)
-                except Exception as e:
-                    logger.warning(f"ChatGPT API failed, falling back to dummy: {e}")
-                    description = self._get_dummy_description(measurements)
-            else:
-                # ダミーレスポンスを使用
-                description = self._get_dummy_description(measurements)
-            
-            return {
+            description, cacheable = await self._get_cached_chatgpt_description(measurements)
+            return description, "chatgpt", cacheable
+        except OpenAIError as e:
+            logger.warning(f"ChatGPT API failed, falling back to dummy: {e}")
+            # 一時的なフォールバックなのでキャッシュさせない
+            return self._get_dummy_description(measurements), "dummy", False
+    
+    async def _describe_with_dummy(self, measurements: Dict[str, Any]) -> Tuple[Dict[str, str], str, bool]:
+        """ダミーレスポンスで説明を生成"""
+        return self._get_dummy_description(measurements), "dummy", True
+    
+    def _to_cm(self, measurements: Dict[str, Any]) -> Dict[str, Any]:
+        """長さの測定値をセンチメートル単位に揃える"""
+        if self.units == "cm":
+            return measurements
+        
+        normalized = dict(measurements)
+        for name in self._LENGTH_FIELDS:
+            value = normalized.get(name)
+            if isinstance(value, (int, float)):
+                normalized[name] = value / 10.0
+        return normalized
+    
+    @staticmethod
+    def _cache_key(measurements: Dict[str, Any]) -> Tuple:
+        """測定値を丸めてキャッシュキーを作成（長さは1mm、AHIは0.001単位）"""
+        def q(name: str, ndigits: int):
+            value = measurements.get(name)
+            return round(value, ndigits) if isinstance(value, (int, float)) else value
+        
+        return (
+            q('foot_length', 1),
+            q('foot_width', 1),
+            q('circumference', 1),
+            q('dorsum_height_50', 1),
+            q('ahi', 3),
+        )
+    
+    async def _get_cached_chatgpt_description(self, measurements: Dict[str, Any]) -> Tuple[Dict[str, str], bool]:
+        """ほぼ同一の測定値に対してはキャッシュ済みのChatGPT応答を返す（説明, キャッシュ可能か）"""
+        key = self._cache_key(measurements)
+        cached = self._description_cache.get(key)
+        if cached is not None:
+            self._description_cache.move_to_end(key)
+            return dict(cached), True
+        
+        description, complete = await self._get_chatgpt_description(measurements)
+        # 期待する項目が揃わなかった応答はキャッシュせず、次回は再度問い合わせる
+        if complete:
+            self._description_cache[key] = description
+            if len(self._description_cache) > DESCRIPTION_CACHE_SIZE:
+                self._description_cache.popitem(last=False)
+        return dict(description), complete
+    
+    async def analyze_foot_measurements_batch(self, measurements_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        複数の足（左右の足など）の測定結果を1回のChatGPTリクエストでまとめて分析
+        
+        Args:
+            measurements_list: 足の測定データのリスト
+        
+        Returns:
+            list: 入力と同じ順序の解析結果と自然言語説明
+        """
+        if not self.client:
+            return [await self.analyze_foot_measurements(m) for m in measurements_list]
+        
+        normalized_list = [self._to_cm(m) for m in measurements_list]
+        try:
+            descriptions, cacheable = await self._get_chatgpt_descriptions_batch(normalized_list)
+            source = "chatgpt"
+        except Exception as e:
+            logger.warning(f"ChatGPT batch API failed, falling back to dummy: {e}")
+            descriptions = [self._get_dummy_description(m) for m in normalized_list]
+            cacheable = [False] * len(descriptions)
+            source = "dummy"
+        
+        return [
+            {
                 "success": True,
                 "numerical_analysis": measurements,
                 "linguistic_description": description,
-                "analysis_source": "chatgpt" if self.client and "dummy" not in str(description) else "dummy"
+                "analysis_source": source,
+                "cacheable": complete
             }
+            for measurements, description, complete in zip(measurements_list, descriptions, cacheable)
+        ]
+    
+    async def _get_chatgpt_descriptions_batch(self, measurements_list: List[Dict[str, Any]]) -> Tuple[List[Dict[str, str]], List[bool]]:
+        """キャッシュにない測定結果のみを1回のChatGPTリクエストで説明生成（説明のリスト, キャッシュ可能か）"""
+        keys = [self._cache_key(m) for m in measurements_list]
+        descriptions: List[Optional[Dict[str, str]]] = [self._description_cache.get(key) for key in keys]
+        pending = [i for i, d in enumerate(descriptions) if d is None]
+        cacheable = [d is not None for d in descriptions]
+        
+        if pending:
+            data_summary = "\n".join(
+                f"[{n}]{self._format_data_summary(measurements_list[i])}"
+                for n, i in enumerate(pending, start=1)
+            )
             
-        except Exception as e:
-            logger.error(f"Error in foot analysis: {e}")
-            # エラー時もダミーレスポンスを返す
-            return {
-                "success": True,
-                "numerical_analysis": measurements,
-                "linguistic_description": self._get_dummy_description(measurements),
-                "analysis_source": "dummy_fallback",
-                "error": str(e)
-            }
+            response = await self._create_completion(
+                model=self.model,
+                messages=[
+                    self._BATCH_SYSTEM_MSG,
+                    {
+                        "role": "user",
+                        "content": f"以下の{len(pending)}件の足を分析してください。\n{data_summary}"
+                    }
+                ],
+                response_format={"type": "json_object"},
+                max_tokens=800 * len(pending),
+                temperature=0.7
+            )
+            
+            analyses = orjson.loads(response.choices[0].message.content)["analyses"]
+            if len(analyses) != len(pending):
+                raise ValueError(f"Expected {len(pending)} analyses, got {len(analyses)}")
+            
+            for i, analysis in zip(pending, analyses):
+                description, cacheable[i] = self._description_from_json(analysis)
+                descriptions[i] = description
+                if cacheable[i]:
+                    self._description_cache[keys[i]] = description
+            while len(self._description_cache) > DESCRIPTION_CACHE_SIZE:
+                self._description_cache.popitem(last=False)
+        
+        return [dict(d) for d in descriptions], cacheable
     
-    def _get_chatgpt_description(self, measurements: Dict[str, Any]) -> Dict[str, str]:
-        """ChatGPT APIを使用して説明を生成"""
+    @staticmethod
+    def _description_from_json(analysis: Dict[str, Any]) -> Tuple[Dict[str, str], bool]:
+        """ChatGPTのJSON応答を説明に変換（説明, すべての項目が空でない文字列として揃ったか）
+
+        文字列の配列は改行で連結する。それ以外の型の値は空文字列とし、不完全な応答として扱う。
+        """
+        description = {}
+        for field in DESCRIPTION_FIELDS:
+            value = analysis.get(field)
+            if isinstance(value, list) and all(isinstance(item, str) for item in value):
+                value = "\n".join(value)
+            description[field] = value if isinstance(value, str) else ""
+        return description, all(text.strip() for text in description.values())
+    
+    @staticmethod
+    def _format_data_summary(measurements: Dict[str, Any]) -> str:
+        """ChatGPTへ渡す測定データの要約文を作成"""
+        return _DATA_SUMMARY_TPL % tuple(measurements.get(name, 'N/A') for name in _DATA_SUMMARY_FIELDS)
+    
+    async def _get_chatgpt_description(self, measurements: Dict[str, Any]) -> Tuple[Dict[str, str], bool]:
+        """ChatGPT APIを使用して説明を生成（説明, 期待する項目がすべて揃ったか）"""
         try:
             # 測定データを整理
-            data_summary = f"""
-足の測定結果:
-- 足長: {measurements.get('foot_length', 'N/A')} cm
-- 足幅: {measurements.get('foot_width', 'N/A')} cm
-- 足囲: {measurements.get('circumference', 'N/A')} cm
-- 甲高(50%位置): {measurements.get('dorsum_height_50', 'N/A')} cm
-- AHI指数: {measurements.get('ahi', 'N/A')}
-- 点群数: {measurements.get('point_count', 'N/A')} 点
-"""
+            data_summary = self._format_data_summary(measurements)
             
             # ChatGPTにリクエスト
-            response = self.client.chat.completions.create(
-                model="gpt-5-mini",
+            response = await self._create_completion(
+                model=self.model,
                 messages=[
-                    {
-                        "role": "system",
-                        "content": """あなたは足の測定データを分析する専門家です。
-                        足の測定結果を受け取り、以下の観点から分析して具体的で実用的な日本語アドバイスを提供してください：
-                        
-                        1. 全体的な足の特徴（測定値を基準とした客観的評価）
-                        2. 足の形状の特徴（数値的根拠に基づく分析）
-                        3. 靴選びのアドバイス（具体的なワイズ、サイズ、ブランド推奨含む）
-                        4. 健康面での注意点（足の形状に基づく具体的なケア方法）
-                        
-                        測定値の基準:
-                        - 足長: 日本人平均 男性25.5cm、女性23.5cm
-                        - 足幅: 標準的な比率は足長の約40-42%
-                        - 足囲: 標準的な比率は足長の約90-95%
-                        - 甲高: 標準的な比率は足長の約25-28%
-                        - AHI指数: 250-300が標準的
-                        
-                        具体的な数値を用いて、実用的で行動可能なアドバイスを提供してください。"""
-                    },
+                    self._SYSTEM_MSG,
                     {
                         "role": "user",
                         "content": data_summary
                     }
                 ],
+                response_format={"type": "json_object"},
                 max_tokens=800,
                 temperature=0.7
             )
             
-            full_description = response.choices[0].message.content
+            content = response.choices[0].message.content
+            
+            # JSONとして一度だけ解析
+            try:
+                parsed = orjson.loads(content)
+            except (orjson.JSONDecodeError, TypeError):
+                parsed = None
+            if isinstance(parsed, dict):
+                return self._description_from_json(parsed)
             
-            # レスポンスを構造化
+            # JSONでない応答の場合のみ見出しからセクションを抽出（キャッシュはしない）
+            full_description = content
+            sections = self._extract_sections(full_description)
             return {
-                "overview": self._extract_section(full_description, "全体的"),
-                "shape_features": self._extract_section(full_description, "形状"),
-                "shoe_advice": self._extract_section(full_description, "靴選び"),
-                "health_notes": self._extract_section(full_description, "健康"),
+                "overview": sections["全体的"],
+                "shape_features": sections["形状"],
+                "shoe_advice": sections["靴選び"],
+                "health_notes": sections["健康"],
                 "full_description": full_description
-            }
+            }, False
             
         except Exception as e:
             logger.error(f"ChatGPT API error: {e}")
             raise
     
-    def _extract_section(self, text: str, keyword: str) -> str:
-        """テキストから特定のセクションを抽出"""
+    async def _create_completion(self, **kwargs):
+        """同時実行数を制限し、レート制限時は指数バックオフで再試行してChatGPTを呼び出す"""
+        from openai import RateLimitError
+        
+        delay = 1.0
+        for attempt in range(self._max_retries + 1):
+            try:
+                async with self._sem:
+                    return await self.client.chat.completions.create(**kwargs)
+            except RateLimitError as e:
+                if attempt >= self._max_retries:
+                    raise
+                logger.warning(f"ChatGPT rate limited, retrying in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+                delay *= 2
+    
+    def _extract_sections(self, text: str) -> Dict[str, str]:
+        """テキストを一度だけ走査して各セクションを抽出"""
         try:
-            lines = text.split('\n')
-            section_lines = []
-            in_section = False
-            keywords = ["全体的", "形状", "靴選び", "健康"]
+            matches = list(_HEADERS_RE.finditer(text))
+            section_lines: Dict[str, list] = {}
+            active = set()
+            closed = set()
             
-            for line in lines:
-                if keyword in line:
-                    in_section = True
-                    section_lines.append(line)
-                elif in_section:
-                    if line.strip() and not any(k in line for k in keywords):
-                        section_lines.append(line)
-                    elif any(k in line for k in keywords if k != keyword):
-                        break
+            for i, m in enumerate(matches):
+                # 1行に複数のキーワードがあれば、それぞれのセクションの見出しとして扱う
+                keywords = set(_SECTION_RE.findall(m.group(0)))
+                # その行に含まれない別の見出しが現れた時点でセクションは終了
+                closed |= active - keywords
+                active = keywords - closed
+                
+                end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+                body = [line for line in text[m.end():end].split('\n') if line.strip()]
+                for keyword in active:
+                    lines = section_lines.setdefault(keyword, [])
+                    lines.append(m.group(0))
+                    lines.extend(body)
             
-            return '\n'.join(section_lines).strip() if section_lines else f"{keyword}に関する情報は抽出できませんでした。"
-        except:
-            return f"{keyword}に関する情報の処理中にエラーが発生しました。"
+            return {
+                keyword: '\n'.join(section_lines[keyword]).strip()
+                if keyword in section_lines else f"{keyword}に関する情報は抽出できませんでした。"
+                for keyword in SECTION_KEYWORDS
+            }
+        except Exception:
+            return {keyword: f"{keyword}に関する情報の処理中にエラーが発生しました。" for keyword in SECTION_KEYWORDS}
     
     def _get_dummy_description(self, measurements: Dict[str, Any]) -> Dict[str, str]:
         """ダミーの説明を生成"""
@@ -162,87 +452,46 @@ class FootAnalysisDescriptor:
         ahi = measurements.get('ahi', 0)
         
         # 足長による基本分析（センチメートル単位）
-        if foot_length > 27.0:
-            size_category = "大きめ"
-            shoe_size = "27.5cm以上"
-            size_advice = f"足長{foot_length:.1f}cmは大きめです。靴のサイズは{shoe_size}をお選びください。つま先に1-1.5cm程度のゆとりを確保してください。"
-        elif foot_length > 24.0:
-            size_category = "標準的"
-            shoe_size = f"{foot_length + 1.0:.1f}cm程度"
-            size_advice = f"足長{foot_length:.1f}cmは標準的です。靴のサイズは{shoe_size}が適しています。"
-        else:
-            size_category = "小さめ"
-            shoe_size = f"{foot_length + 0.5:.1f}cm程度"
-            size_advice = f"足長{foot_length:.1f}cmは小さめです。靴のサイズは{shoe_size}をお選びください。フィット感を重視してください。"
+        size_category, shoe_size_tpl, size_offset, size_advice_tpl = self._SIZE_ROWS[bisect.bisect_left(self._SIZE_BINS, foot_length)]
+        shoe_size = shoe_size_tpl.format(foot_length + size_offset)
+        size_advice = size_advice_tpl.format(foot_length=foot_length, shoe_size=shoe_size)
         
         # 足幅による分析（実際の足長との比率で判定）
         width_ratio = (foot_width / foot_length * 100) if foot_length > 0 else 0
-        if width_ratio > 42:
-            width_category = "幅広"
-            width_advice = f"足幅{foot_width:.1f}cm（足長比{width_ratio:.1f}%）は幅広です。3E〜4Eワイズの靴がお勧めです。アシックス、ミズノなどの日本ブランドが適しています。"
-        elif width_ratio > 38:
-            width_category = "標準"
-            width_advice = f"足幅{foot_width:.1f}cm（足長比{width_ratio:.1f}%）は標準的です。E〜2Eワイズの靴が適しています。"
-        else:
-            width_category = "幅狭"
-            width_advice = f"足幅{foot_width:.1f}cm（足長比{width_ratio:.1f}%）は幅狭です。D〜Eワイズの靴をお選びください。海外ブランドも選択肢に入ります。"
+        width_category, width_advice_tpl = self._WIDTH_ROWS[bisect.bisect_left(self._WIDTH_BINS, width_ratio)]
+        width_advice = width_advice_tpl.format(foot_width=foot_width, width_ratio=width_ratio)
         
         # 甲高分析（実際の足長との比率で判定）
         height_ratio = (dorsum_height / foot_length * 100) if foot_length > 0 else 0
-        if height_ratio > 28:
-            height_analysis = f"甲高{dorsum_height:.1f}cm（足長比{height_ratio:.1f}%）は高めです。甲部分にゆとりのある靴や調整可能な紐靴をお選びください。"
-        elif height_ratio > 25:
-            height_analysis = f"甲高{dorsum_height:.1f}cm（足長比{height_ratio:.1f}%）は標準的です。一般的な靴で問題ありません。"
-        else:
-            height_analysis = f"甲高{dorsum_height:.1f}cm（足長比{height_ratio:.1f}%）は低めです。フィット感の良い靴や薄型インソールの使用をお勧めします。"
+        height_analysis = self._HEIGHT_ROWS[bisect.bisect_left(self._HEIGHT_BINS, height_ratio)].format(
+            dorsum_height=dorsum_height, height_ratio=height_ratio
+        )
         
         # AHI指数による詳細分析
-        if ahi > 300:
-            ahi_analysis = f"AHI指数{ahi:.1f}は高めで、甲が高い特徴があります。"
-            health_advice = "甲の圧迫を避けるため、調整可能な靴紐の靴を選び、きつく締めすぎないよう注意してください。"
-        elif ahi > 250:
-            ahi_analysis = f"AHI指数{ahi:.1f}は標準的で、バランスの良い足型です。"
-            health_advice = "標準的な足型なので、一般的な靴選びの指標に従ってください。"
-        else:
-            ahi_analysis = f"AHI指数{ahi:.1f}は低めで、甲が薄い特徴があります。"
-            health_advice = "足のサポートを強化するため、適切なインソールの使用を検討してください。"
+        ahi_analysis_tpl, health_advice = self._AHI_ROWS[bisect.bisect_left(self._AHI_BINS, ahi)]
+        ahi_analysis = ahi_analysis_tpl.format(ahi=ahi)
         
         return {
             "overview": f"足長{foot_length:.1f}cm、足幅{foot_width:.1f}cmの{size_category}サイズです。{width_category}幅で{height_analysis.split('。')[0]}。全体的にバランスの良い足型です。",
             "shape_features": f"{ahi_analysis} 足長に対する足幅比率は{width_ratio:.1f}%、甲高比率は{height_ratio:.1f}%です。",
             "shoe_advice": f"{size_advice} {width_advice} 靴選びの際は試着を必須とし、午後の足が膨らんだ時間帯に選ぶことをお勧めします。",
             "health_notes": f"{health_advice} 定期的な足のケアと適切な靴選びにより、足の健康を維持してください。歩行時に痛みを感じる場合は専門医にご相談ください。",
-            "full_description": f"""
-【足の測定結果分析】
-
-■ 全体的な特徴
-足長: {foot_length:.1f}cm ({size_category})
-足幅: {foot_width:.1f}cm ({width_category}、足長比{width_ratio:.1f}%)
-足囲: {circumference:.1f}cm
-甲高: {dorsum_height:.1f}cm (足長比{height_ratio:.1f}%)
-AHI指数: {ahi:.1f}
-
-■ 形状の特徴
-{ahi_analysis}
-{height_analysis}
-
-■ 靴選びのアドバイス
-【サイズ】{size_advice}
-【幅・ワイズ】{width_advice}
-【推奨事項】
-- 試着は午後に行う（足が膨らんだ状態で確認）
-- つま先に1-1.5cmのゆとりを確保
-- かかとがしっかりフィットすることを確認
-- 歩行時の足の動きを考慮してサイズを選択
-
-■ 健康面での注意点
-{health_advice}
-- 定期的な足のマッサージとストレッチを実施
-- 長時間同じ靴を履き続けない
-- 足の変化に応じて定期的にサイズを見直す
-- 痛みや違和感がある場合は早めに専門医に相談
-"""
+            "full_description": _DUMMY_FULL_DESCRIPTION_TPL % (
+                foot_length, size_category,
+                foot_width, width_category, width_ratio,
+                circumference,
+                dorsum_height, height_ratio,
+                ahi,
+                ahi_analysis,
+                height_analysis,
+                size_advice,
+                width_advice,
+                health_advice
+            )
         }
 
-# グローバルインスタンス
-foot_analyzer = FootAnalysisDescriptor()
+# 共有インスタンス（初回呼び出し時に一度だけ生成）
+@functools.lru_cache(maxsize=1)
+def get_foot_analyzer() -> FootAnalysisDescriptor:
+    """共有のFootAnalysisDescriptorを取得"""
+    return FootAnalysisDescriptor()
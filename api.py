@@ -1,24 +1,101 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import FileResponse
+import fastapi
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import tempfile
 import os
 import shutil
-import base64
-from process import process_ply_file
-from analysis_descriptor import foot_analyzer
+import hashlib
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Tuple
+from analysis_descriptor import FootAnalysisDescriptor
 import uvicorn
 from datetime import datetime
 from dotenv import load_dotenv
 
+try:
+    import pybase64 as base64  # SIMD実装（未インストール時は標準ライブラリ）
+except ImportError:
+    import base64
+
+# FastAPI 0.131以降はPydanticで直接JSONへシリアライズし、ORJSONResponseは非推奨（生成のたびに警告が出る）
+if tuple(int(part) for part in fastapi.__version__.split(".")[:2]) >= (0, 131):
+    from fastapi.responses import JSONResponse
+else:
+    from fastapi.responses import ORJSONResponse as JSONResponse
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
 # 環境変数を読み込み
 load_dotenv()
 
+# アップロードと処理結果の一時ファイルを置くディレクトリ（既定はRAM上のtmpfs）
+UPLOAD_ROOT = os.getenv("UPLOAD_ROOT", "/dev/shm/foot_measure" if os.path.isdir("/dev/shm") else "") or None
+# /analyze-descriptionの応答をクライアントにキャッシュさせる秒数
+ANALYSIS_CACHE_MAX_AGE = int(os.getenv("ANALYSIS_CACHE_MAX_AGE", "3600"))
+# /process-with-fileの処理結果をクライアントにキャッシュさせる秒数
+PROCESSED_FILE_CACHE_MAX_AGE = int(os.getenv("PROCESSED_FILE_CACHE_MAX_AGE", "600"))
+# プロセスプールの1ジョブが使うスレッド数（近傍探索とOpen3DのOpenMP）
+# ジョブは並列に実行されるため、既定の1ではワーカー1つがCPUコア1つを使う
+POOL_JOB_THREADS = int(os.getenv("POOL_JOB_THREADS", "1"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """起動時に解析器（OpenAIクライアント）と点群処理用のプロセスプールを生成し、終了時に解放する"""
+    if UPLOAD_ROOT:
+        os.makedirs(UPLOAD_ROOT, exist_ok=True)
+    # 終了時に閉じるため、共有のget_foot_analyzer()ではなくアプリ専用のインスタンスを生成する
+    app.state.foot_analyzer = FootAnalysisDescriptor()
+    # サーバーワーカー間でCPUコアを分け合い、各ジョブのスレッド数も考慮してプールの大きさを決める
+    default_pool_workers = max(1, (os.cpu_count() or 1) // (int(os.getenv("WEB_CONCURRENCY", "1")) * POOL_JOB_THREADS))
+    # CPU負荷の高い点群処理はGILの影響を受けないよう別プロセスで並列実行
+    # （スレッドを持つプロセスをforkしないようspawnを使用）
+    app.state.process_pool = ProcessPoolExecutor(
+        max_workers=int(os.getenv("PROCESS_POOL_WORKERS", str(default_pool_workers))),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_pool_worker,
+        initargs=(POOL_JOB_THREADS,)
+    )
+    yield
+    app.state.process_pool.shutdown(wait=False, cancel_futures=True)
+    await app.state.foot_analyzer.aclose()
+
+async def run_in_process_pool(request: Request, func, *args, **kwargs):
+    """関数をプロセスプールで実行して結果を待つ"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(request.app.state.process_pool, functools.partial(func, *args, **kwargs))
+
+# プロセスプールへ渡すジョブ（処理モジュールはワーカープロセス側でのみ読み込み、
+# Open3D・NumPy・SciPy等の重い依存をサーバープロセスに読み込ませない）
+def init_pool_worker(threads: int):
+    """ワーカープロセスのスレッド数を制限（OpenMPの設定はOpen3Dの読み込み前に行う必要がある）"""
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+
+def process_ply_job(*args, **kwargs):
+    """ワーカープロセスでPLYファイルを処理する"""
+    from process import process_ply_file
+    return process_ply_file(*args, workers=POOL_JOB_THREADS, **kwargs)
+
+def shoe_match_job(*args, **kwargs):
+    """ワーカープロセスで足と靴の一致度を解析する"""
+    from shoe_match import analyze_foot_shoe_match
+    return analyze_foot_shoe_match(*args, **kwargs)
+
 app = FastAPI(
     title="Foot Measurement API",
     description="PLYファイルを処理して足の寸法を測定するAPI",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=JSONResponse
 )
 
 # CORS設定を追加
@@ -33,6 +110,145 @@ app.add_middleware(
 # 静的ファイルの配信設定
 app.mount("/static", StaticFiles(directory="."), name="static")
 
+def round_measurement(value, ndigits: int = 3):
+    """レスポンス用に測定値をPythonのfloatへ変換して丸める"""
+    return None if value is None else round(float(value), ndigits)
+
+def _write_upload_chunks(chunks, open_fds):
+    """受信したチャンクを書き出し、終端（None）に達したファイルを閉じてopen_fdsから外す（ブロッキング処理）"""
+    for fd, data in chunks:
+        if data is None:
+            open_fds.discard(fd)
+            os.close(fd)
+            continue
+        while data:
+            written = os.write(fd, data)
+            data = data[written:]
+
+async def stream_ply_uploads(request: Request, targets: Dict[str, Tuple[str, str]]) -> Dict[str, str]:
+    """
+    multipart/form-dataのボディを受信しながら、指定フィールドのPLYファイルを直接ディスクへ書き出す
+    
+    Args:
+        request: アップロードを含むリクエスト
+        targets: フィールド名 -> (保存先パス, PLY以外が送られた場合のエラーメッセージ)
+    
+    Returns:
+        dict: フィールド名 -> アップロードされたファイル名
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail="multipart/form-data形式で送信してください")
+    
+    filenames: Dict[str, str] = {}
+    open_fds = set()  # 実際に閉じるまで保持し、途中で例外が発生した場合はfinallyで閉じる
+    pending = []  # (fd, data) — dataがNoneの場合はファイル終端
+    part = {"fd": None, "field": b"", "value": b"", "headers": {}}
+    
+    def on_part_begin():
+        part.update(fd=None, field=b"", value=b"", headers={})
+    
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+    
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+    
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part.update(field=b"", value=b"")
+    
+    def on_headers_finished():
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        name = disposition.get(b"name", b"").decode("utf-8", "replace")
+        if name not in targets:
+            return
+        # 最初のチャンクを書き出す前にファイル形式をチェック
+        filename = disposition.get(b"filename", b"").decode("utf-8", "replace")
+        path, error_detail = targets[name]
+        if not filename.lower().endswith('.ply'):
+            raise HTTPException(status_code=400, detail=error_detail)
+        filenames[name] = filename
+        part["fd"] = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        open_fds.add(part["fd"])
+    
+    def on_part_data(data, start, end):
+        if part["fd"] is not None:
+            pending.append((part["fd"], memoryview(data)[start:end]))
+    
+    def on_part_end():
+        if part["fd"] is not None:
+            pending.append((part["fd"], None))
+            part["fd"] = None
+    
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if pending:
+                # ネットワーク受信と並行してディスクへ書き出す
+                chunks = pending[:]
+                pending.clear()
+                await run_in_threadpool(_write_upload_chunks, chunks, open_fds)
+        parser.finalize()
+        if pending:
+            await run_in_threadpool(_write_upload_chunks, pending, open_fds)
+    finally:
+        for fd in open_fds:
+            os.close(fd)
+    
+    missing = [name for name in targets if name not in filenames]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"ファイルが指定されていません: {', '.join(missing)}")
+    return filenames
+
+def read_file_bytes(file_path: str) -> bytes:
+    """ファイル全体を読み込む（ブロッキング処理）"""
+    with open(file_path, "rb") as f:
+        return f.read()
+
+def compute_etag(content: bytes, headers: Dict[str, str]) -> str:
+    """ファイル内容と付随するヘッダー値から強いETagを計算（ブロッキング処理）"""
+    digest = hashlib.blake2b(content, digest_size=16)
+    for name in sorted(headers):
+        digest.update(f"{name}:{headers[name]}\n".encode("utf-8"))
+    return f'"{digest.hexdigest()}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-MatchヘッダーにETagが含まれるか判定"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates or "*" in candidates
+
+def ply_upload_openapi(*fields: str) -> Dict[str, Any]:
+    """ストリーミング受信するエンドポイント用のOpenAPIリクエスト定義"""
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "required": list(fields),
+                        "properties": {field: {"type": "string", "format": "binary"} for field in fields}
+                    }
+                }
+            }
+        }
+    }
+
 @app.get("/")
 async def root():
     """APIの基本情報"""
@@ -60,8 +276,8 @@ async def health_check():
     """ヘルスチェック"""
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
-@app.post("/process")
-async def process_ply(file: UploadFile = File(...)):
+@app.post("/process", openapi_extra=ply_upload_openapi("file"))
+async def process_ply(request: Request):
     """
     PLYファイルを処理して足の寸法を測定し、言語で解析結果を説明
     
@@ -69,30 +285,27 @@ async def process_ply(file: UploadFile = File(...)):
         file: アップロードされたPLYファイル
     
     Returns:
-        dict: 処理結果と寸法情報、および言語による解析説明
+        JSONResponse: 処理結果と寸法情報、および言語による解析説明
     """
-    # ファイル形式チェック
-    if not file.filename.lower().endswith('.ply'):
-        raise HTTPException(status_code=400, detail="PLYファイルのみ対応しています")
-    
     # 一時ディレクトリを作成
-    with tempfile.TemporaryDirectory() as temp_dir:
+    with tempfile.TemporaryDirectory(dir=UPLOAD_ROOT) as temp_dir:
+        input_path = os.path.join(temp_dir, "input.ply")
+        output_path = os.path.join(temp_dir, "output.ply")
+        
+        # アップロードを受信しながら一時保存（ファイル形式チェックを含む）
+        filenames = await stream_ply_uploads(request, {
+            "file": (input_path, "PLYファイルのみ対応しています")
+        })
+        
         try:
-            # アップロードされたファイルを一時保存
-            input_path = os.path.join(temp_dir, "input.ply")
-            output_path = os.path.join(temp_dir, "output.ply")
-            
-            with open(input_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            
-            # PLYファイルを処理
-            result = process_ply_file(input_path, output_path, verbose=False)
+            # PLYファイルを処理（Open3D等の重い依存はワーカープロセス側で読み込む）
+            result = await run_in_process_pool(request, process_ply_job, input_path, output_path, verbose=False)
             
             if not result['success']:
                 raise HTTPException(status_code=500, detail=result['error'])
             
             # 数値解析結果を言語で説明
-            analysis_result = foot_analyzer.analyze_foot_measurements({
+            analysis_result = await request.app.state.foot_analyzer.analyze_foot_measurements({
                 'foot_length': result['foot_length'],
                 'foot_width': result['foot_width'],
                 'circumference': result['circumference'],
@@ -101,33 +314,30 @@ async def process_ply(file: UploadFile = File(...)):
                 'point_count': result['point_count']
             })
             
-            # 処理されたファイルを読み込み
-            if os.path.exists(output_path):
-                with open(output_path, "rb") as f:
-                    processed_file_content = f.read()
-            else:
-                processed_file_content = None
+            # 処理されたファイルの有無のみ確認（内容は返却しない）
+            processed_file_available = os.path.exists(output_path)
             
-            return {
+            return JSONResponse({
                 "success": True,
-                "foot_length": result['foot_length'],
-                "foot_width": result['foot_width'],
-                "circumference": result['circumference'],
-                "dorsum_height_50": result['dorsum_height_50'],
-                "ahi": result['ahi'],
+                "foot_length": round_measurement(result['foot_length']),
+                "foot_width": round_measurement(result['foot_width']),
+                "circumference": round_measurement(result['circumference']),
+                "dorsum_height_50": round_measurement(result['dorsum_height_50']),
+                "ahi": round_measurement(result['ahi']),
                 "point_count": result['point_count'],
                 "linguistic_analysis": analysis_result['linguistic_description'],
                 "analysis_source": analysis_result['analysis_source'],
-                "original_filename": file.filename,
-                "processed_file_available": processed_file_content is not None,
+                "original_filename": filenames["file"],
+                "processed_file_available": processed_file_available,
                 "message": "処理が正常に完了しました"
-            }
+            })
             
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"処理中にエラーが発生しました: {str(e)}")
 
 @app.post("/analyze-description")
 async def analyze_foot_description(
+    request: Request,
     foot_length: float,
     foot_width: float,
     circumference: float,
@@ -147,7 +357,7 @@ async def analyze_foot_description(
         point_count: 点群数
     
     Returns:
-        dict: 言語による解析結果
+        JSONResponse: 言語による解析結果
     """
     try:
         measurements = {
@@ -159,21 +369,28 @@ async def analyze_foot_description(
             'point_count': point_count
         }
         
-        analysis_result = foot_analyzer.analyze_foot_measurements(measurements)
+        foot_analyzer = request.app.state.foot_analyzer
+        analysis_result = await foot_analyzer.analyze_foot_measurements(measurements)
         
-        return {
+        # 同じ測定値には同じ説明を返すため、クライアント側でもキャッシュさせる
+        # （API障害によるダミーへの一時的なフォールバックや不完全な応答はキャッシュさせない）
+        headers = {}
+        if analysis_result['cacheable']:
+            headers["Cache-Control"] = f"public, max-age={ANALYSIS_CACHE_MAX_AGE}"
+        
+        return JSONResponse({
             "success": True,
             "measurements": measurements,
             "linguistic_analysis": analysis_result['linguistic_description'],
             "analysis_source": analysis_result['analysis_source'],
             "message": "言語解析が正常に完了しました"
-        }
+        }, headers=headers)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"解析中にエラーが発生しました: {str(e)}")
 
-@app.post("/process-with-file")
-async def process_ply_with_file(file: UploadFile = File(...)):
+@app.post("/process-with-file", openapi_extra=ply_upload_openapi("file"))
+async def process_ply_with_file(request: Request):
     """
     PLYファイルを処理して足の寸法と結果ファイルを返却（言語解析付き）
     
@@ -181,25 +398,22 @@ async def process_ply_with_file(file: UploadFile = File(...)):
         file: アップロードされたPLYファイル
     
     Returns:
-        FileResponse: 処理されたPLYファイル（ヘッダーに寸法情報と言語解析結果も含む）
+        Response: 処理されたPLYファイル（ヘッダーに寸法情報と言語解析結果も含む）
     """
-    # ファイル形式チェック
-    if not file.filename.lower().endswith('.ply'):
-        raise HTTPException(status_code=400, detail="PLYファイルのみ対応しています")
-    
     # 一時ディレクトリを作成
-    temp_dir = tempfile.mkdtemp()
+    temp_dir = tempfile.mkdtemp(dir=UPLOAD_ROOT)
     
     try:
-        # アップロードされたファイルを一時保存
+        # アップロードを受信しながら一時保存（ファイル形式チェックを含む）
         input_path = os.path.join(temp_dir, "input.ply")
         output_path = os.path.join(temp_dir, "processed_output.ply")
         
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        await stream_ply_uploads(request, {
+            "file": (input_path, "PLYファイルのみ対応しています")
+        })
         
-        # PLYファイルを処理
-        result = process_ply_file(input_path, output_path, verbose=False)
+        # PLYファイルを処理（Open3D等の重い依存はワーカープロセス側で読み込む）
+        result = await run_in_process_pool(request, process_ply_job, input_path, output_path, verbose=False)
         
         if not result['success']:
             raise HTTPException(status_code=500, detail=result['error'])
@@ -207,8 +421,11 @@ async def process_ply_with_file(file: UploadFile = File(...)):
         if not os.path.exists(output_path):
             raise HTTPException(status_code=500, detail="出力ファイルが生成されませんでした")
         
+        # 出力ファイルは一度だけ読み込み、ETagの計算とレスポンス本体の両方に使う
+        content = await run_in_threadpool(read_file_bytes, output_path)
+        
         # 数値解析結果を言語で説明
-        analysis_result = foot_analyzer.analyze_foot_measurements({
+        analysis_result = await request.app.state.foot_analyzer.analyze_foot_measurements({
             'foot_length': result['foot_length'],
             'foot_width': result['foot_width'],
             'circumference': result['circumference'],
@@ -237,27 +454,37 @@ async def process_ply_with_file(file: UploadFile = File(...)):
             "X-Point-Count": str(result['point_count']),
             "X-Processing-Success": "true",
             "X-Analysis-Source": analysis_result['analysis_source'],
-            "X-Analysis-Overview-B64": overview_b64,
-            "Content-Disposition": f'attachment; filename="{output_filename}"'
+            "X-Analysis-Overview-B64": overview_b64
+        }
+        
+        # 同じ結果を取得済みのクライアントには本体を送らない
+        etag = await run_in_threadpool(compute_etag, content, headers)
+        cache_headers = {
+            "ETag": etag,
+            "Cache-Control": f"private, max-age={PROCESSED_FILE_CACHE_MAX_AGE}"
         }
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers=cache_headers)
+        headers.update(cache_headers)
+        headers["Content-Disposition"] = f'attachment; filename="{output_filename}"'
         
-        return FileResponse(
-            path=output_path,
-            filename=output_filename,
+        return Response(
+            content=content,
             headers=headers,
             media_type="application/octet-stream"
         )
         
     except HTTPException:
         # HTTPExceptionは再発生
-        shutil.rmtree(temp_dir, ignore_errors=True)
         raise
     except Exception as e:
-        shutil.rmtree(temp_dir, ignore_errors=True)
         raise HTTPException(status_code=500, detail=f"処理中にエラーが発生しました: {str(e)}")
+    finally:
+        # 内容はメモリ上にあるため、レスポンスを待たずに一時ディレクトリを削除
+        shutil.rmtree(temp_dir, ignore_errors=True)
 
-@app.post("/match")
-async def match_foot_shoe(foot_file: UploadFile = File(...), shoe_file: UploadFile = File(...)):
+@app.post("/match", openapi_extra=ply_upload_openapi("foot_file", "shoe_file"))
+async def match_foot_shoe(request: Request):
     """
     足の点群ファイルと靴の点群ファイルを受け取って一致度を解析
     
@@ -268,37 +495,28 @@ async def match_foot_shoe(foot_file: UploadFile = File(...), shoe_file: UploadFi
     Returns:
         dict: 一致度解析結果
     """
-    # ファイル形式チェック
-    if not foot_file.filename.lower().endswith('.ply'):
-        raise HTTPException(status_code=400, detail="足ファイルはPLY形式である必要があります")
-    
-    if not shoe_file.filename.lower().endswith('.ply'):
-        raise HTTPException(status_code=400, detail="靴ファイルはPLY形式である必要があります")
-    
     # 一時ディレクトリを作成
-    with tempfile.TemporaryDirectory() as temp_dir:
+    with tempfile.TemporaryDirectory(dir=UPLOAD_ROOT) as temp_dir:
+        foot_path = os.path.join(temp_dir, "foot.ply")
+        shoe_path = os.path.join(temp_dir, "shoe.ply")
+        
+        # アップロードを受信しながら一時保存（ファイル形式チェックを含む）
+        filenames = await stream_ply_uploads(request, {
+            "foot_file": (foot_path, "足ファイルはPLY形式である必要があります"),
+            "shoe_file": (shoe_path, "靴ファイルはPLY形式である必要があります")
+        })
+        
         try:
-            # アップロードされたファイルを一時保存
-            foot_path = os.path.join(temp_dir, "foot.ply")
-            shoe_path = os.path.join(temp_dir, "shoe.ply")
-            
-            with open(foot_path, "wb") as buffer:
-                shutil.copyfileobj(foot_file.file, buffer)
-                
-            with open(shoe_path, "wb") as buffer:
-                shutil.copyfileobj(shoe_file.file, buffer)
-            
             # ダミー解析処理を呼び出し
-            from shoe_match import analyze_foot_shoe_match
-            result = analyze_foot_shoe_match(foot_path, shoe_path)
+            result = await run_in_process_pool(request, shoe_match_job, foot_path, shoe_path)
             
             return {
                 "success": True,
                 "match_score": result['match_score'],
                 "fit_analysis": result['fit_analysis'],
                 "recommendations": result['recommendations'],
-                "foot_filename": foot_file.filename,
-                "shoe_filename": shoe_file.filename,
+                "foot_filename": filenames["foot_file"],
+                "shoe_filename": filenames["shoe_file"],
                 "message": "一致度解析が正常に完了しました"
             }
             
@@ -306,10 +524,17 @@ async def match_foot_shoe(foot_file: UploadFile = File(...), shoe_file: UploadFi
             raise HTTPException(status_code=500, detail=f"解析中にエラーが発生しました: {str(e)}")
 
 if __name__ == "__main__":
-    # APIサーバーを起動
+    # APIサーバーを起動（開発時のみ自動リロード、本番は複数ワーカー）
+    # （イベントループとHTTPパーサーはuvicornの既定"auto"により、uvloop・httptoolsがあればそれを使う）
+    is_development = os.getenv("APP_ENV", "production") == "development"
+    workers = 1 if is_development else int(os.getenv("WEB_CONCURRENCY", str(max(2, os.cpu_count() or 1))))
+    # 各ワーカーのプロセスプールがCPU数を分け合えるよう子プロセスへ伝える
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    
     uvicorn.run(
         "api:app",
         host="0.0.0.0",
         port=8000,
-        reload=True
+        workers=workers,
+        reload=is_development
     )
@@ -2,24 +2,85 @@ import open3d as o3d
 import numpy as np
 import os
 import random
-from sklearn.decomposition import PCA
+from numpy.lib.recfunctions import structured_to_unstructured
 from plyfile import PlyData, PlyElement
 
+# 法線・色（f_dc_0, f_dc_1, f_dc_2）として読み込むPLYのフィールド
+NORMAL_FIELDS = ('nx', 'ny', 'nz')
+COLOR_FIELDS = ('f_dc_0', 'f_dc_1', 'f_dc_2')
+_NORMAL_FIELD_SET = frozenset(NORMAL_FIELDS)
+_COLOR_FIELD_SET = frozenset(COLOR_FIELDS)
+
 # 再現性のためのシード固定
 np.random.seed(42)
 random.seed(42)
 
+def polygon_perimeter(vertices):
+    """順序付きの頂点 (M, 2) からなる閉じた多角形の周囲長を計算"""
+    edges = np.diff(vertices, axis=0, append=vertices[:1])
+    return float(np.hypot(edges[:, 0], edges[:, 1]).sum())
+
 class PointCloudProcessor:
-    def __init__(self):
-        """点群処理クラスの初期化"""
+    def __init__(self, verbose=True, workers=-1):
+        """点群処理クラスの初期化（verboseは各メソッドで指定しない場合の詳細ログ表示の既定値、
+        workersは近傍探索のスレッド数で-1は全コア）"""
         self.point_cloud = None
+        self.verbose = verbose
+        self.workers = workers
         # Open3Dの内部乱数も固定
         o3d.utility.random.seed(42)
-        
-    def load_ply_file(self, file_path, verbose=True):
+    
+    @property
+    def point_cloud(self):
+        """処理中の点群（差し替えると座標列のキャッシュを破棄）"""
+        return self._point_cloud
+    
+    @point_cloud.setter
+    def point_cloud(self, value):
+        self._point_cloud = value
+        self._invalidate_point_cache()
+    
+    @property
+    def coords(self):
+        """点座標の (N, 3) float64配列
+
+        Open3Dのバッファを共有するC連続のビューなので、その場での書き換えは点群に反映され、
+        そのままBLAS等に渡せる。座標を書き換えた場合は _invalidate_point_cache() を呼ぶこと。
+        """
+        return np.asarray(self.point_cloud.points)
+    
+    def _invalidate_point_cache(self):
+        """点座標から求めたキャッシュ（座標列と各軸の範囲）を破棄"""
+        self._columns = None
+        self._extents = None
+    
+    def _point_columns(self):
+        """点座標をX, Y, Z列ごとの連続したfloat32配列 (x, y, z) として返す
+
+        寸法計算の最小・最大やスライスのマスクは1〜2列しか参照しないため、
+        (N, 3) のfloat64配列を飛び飛びに読むより転送量が少ない。
+        点座標をその場で書き換えた場合は _invalidate_point_cache() でキャッシュを破棄すること。
+        """
+        if self._columns is None:
+            points = self.coords
+            self._columns = tuple(np.ascontiguousarray(points[:, axis], dtype=np.float32) for axis in range(3))
+        return self._columns
+    
+    def _point_extents(self):
+        """各軸の最小値と最大値 ((x_min, y_min, z_min), (x_max, y_max, z_max)) を返す
+
+        寸法・周囲長・甲高の各計算で同じ範囲を使うため、点群が変わるまで一度だけ計算する。
+        """
+        if self._extents is None:
+            columns = self._point_columns()
+            self._extents = (tuple(c.min() for c in columns), tuple(c.max() for c in columns))
+        return self._extents
+        
+    def load_ply_file(self, file_path, verbose=None):
         """PLYファイルを読み込み（f_dc_0, f_dc_1, f_dc_2をRGBとして扱う）"""
-        # PLYファイルを直接読み込み
-        plydata = PlyData.read(file_path)
+        verbose = self.verbose if verbose is None else verbose
+        # PLYファイルを直接読み込み（バイナリPLYは読み取り専用でメモリマップし、コピーせずに参照する）
+        plydata = PlyData.read(file_path, mmap='r')
         vertex = plydata['vertex']
         
         # vertexの構造を確認
@@ -29,15 +90,17 @@ class PointCloudProcessor:
         
         # 利用可能なフィールド名を取得
         available_fields = [prop.name for prop in vertex.properties]
+        available_field_set = frozenset(available_fields)
         if verbose:
             print(f"Available fields: {available_fields}")
         
+        # 構造化配列から必要なフィールドをまとめて (N, 3) 配列として取り出す
+        # Open3DのVector3dVectorはC連続のfloat64をそのまま受け取れるため、その形式に一度で変換する
+        data = vertex.data
+        
         # 座標データを取得（メートル単位からセンチメートル単位に変換）
-        points = np.column_stack([
-            vertex['x'] * 100,  # m -> cm
-            vertex['y'] * 100,  # m -> cm
-            vertex['z'] * 100   # m -> cm
-        ])
+        points = structured_to_unstructured(data[['x', 'y', 'z']], dtype=np.float64, copy=True)
+        points *= 100  # m -> cm
         
         if verbose:
             print(f"Converted coordinates from meters to centimeters")
@@ -48,31 +111,30 @@ class PointCloudProcessor:
         pcd.points = o3d.utility.Vector3dVector(points)
         
         # 法線データがある場合は設定
-        if 'nx' in available_fields:
-            normals = np.column_stack([
-                vertex['nx'],
-                vertex['ny'],
-                vertex['nz']
-            ])
+        if _NORMAL_FIELD_SET <= available_field_set:
+            normals = structured_to_unstructured(data[list(NORMAL_FIELDS)], dtype=np.float64, copy=True)
             pcd.normals = o3d.utility.Vector3dVector(normals)
         
         # f_dc_0, f_dc_1, f_dc_2をRGB色として設定
-        if all(prop in available_fields for prop in ['f_dc_0', 'f_dc_1', 'f_dc_2']):
+        if _COLOR_FIELD_SET <= available_field_set:
             # f_dc値を0-1の範囲に正規化してRGBに変換
-            colors = np.column_stack([
-                vertex['f_dc_0'],
-                vertex['f_dc_1'],
-                vertex['f_dc_2']
-            ])
+            colors = structured_to_unstructured(data[list(COLOR_FIELDS)], dtype=np.float64, copy=True)
             
             if verbose:
                 print(f"Color range before normalization: R[{colors[:,0].min():.3f}-{colors[:,0].max():.3f}], G[{colors[:,1].min():.3f}-{colors[:,1].max():.3f}], B[{colors[:,2].min():.3f}-{colors[:,2].max():.3f}]")
             
-            # 値の範囲を確認し、必要に応じて正規化
-            if colors.max() > 1.0 or colors.min() < 0.0:
-                colors = (colors - colors.min()) / (colors.max() - colors.min())
-                if verbose:
-                    print(f"Color range after normalization: R[{colors[:,0].min():.3f}-{colors[:,0].max():.3f}], G[{colors[:,1].min():.3f}-{colors[:,1].max():.3f}], B[{colors[:,2].min():.3f}-{colors[:,2].max():.3f}]")
+            color_dtype = data.dtype[COLOR_FIELDS[0]]
+            if color_dtype.kind == 'u':
+                # 符号なし整数（uint8等）の色は型の最大値で割るだけで0-1になるため、範囲の走査は不要
+                np.multiply(colors, 1.0 / np.iinfo(color_dtype).max, out=colors)
+            else:
+                # 値の範囲を確認し、必要に応じて正規化（最小・最大は一度だけ計算し、配列はその場で更新）
+                cmin, cmax = colors.min(), colors.max()
+                if cmax > 1.0 or cmin < 0.0:
+                    np.subtract(colors, cmin, out=colors)
+                    np.multiply(colors, 1.0 / (cmax - cmin), out=colors)
+                    if verbose:
+                        print(f"Color range after normalization: R[{colors[:,0].min():.3f}-{colors[:,0].max():.3f}], G[{colors[:,1].min():.3f}-{colors[:,1].max():.3f}], B[{colors[:,2].min():.3f}-{colors[:,2].max():.3f}]")
             
             pcd.colors = o3d.utility.Vector3dVector(colors)
         
@@ -87,13 +149,37 @@ class PointCloudProcessor:
         if self.point_cloud is None:
             return False
         
-        points = np.asarray(self.point_cloud.points)
-        points[:, 1] = -points[:, 1]  # Y軸を反転
-        self.point_cloud.points = o3d.utility.Vector3dVector(points)
+        # np.asarrayはOpen3Dのバッファを共有するビューなので、その場で反転する
+        points = self.coords
+        points[:, 1] *= -1  # Y軸を反転
+        self._invalidate_point_cache()
+        return True
+    
+    def downsample(self, voxel_size, verbose=None):
+        """ボクセルダウンサンプリングで点数を減らす（voxel_sizeはセンチメートル単位）
+
+        以降の平面除去・主成分分析・外れ値除去はいずれも点数に比例して重くなるため、
+        大きな点群では読み込み直後に行うと効果が大きい。寸法は僅かに変わる。
+        """
+        verbose = self.verbose if verbose is None else verbose
+        if self.point_cloud is None:
+            return False
+        
+        self.point_cloud = self.point_cloud.voxel_down_sample(voxel_size)
+        if verbose:
+            print(f"ボクセルダウンサンプリング後の点数: {len(self.point_cloud.points)}")
         return True
     
-    def remove_planes(self, distance_threshold=1.0, ransac_n=10, num_iterations=1000, verbose=True):
-        """平面フィッティングで主要な平面を1つ除去（再現性のため固定シード）"""
+    def remove_planes(self, distance_threshold=1.0, ransac_n=10, num_iterations=1000, fast=False,
+                      max_tilt_deg=3.0, min_inlier_ratio=0.2, verbose=None):
+        """主要な平面（床面）を1つ除去
+
+        通常はRANSAC平面フィッティングを使う（再現性のため固定シード）。
+        fast=Trueの場合はY座標のヒストグラムと最小二乗の当てはめで床面を求める（detect_floor_plane）。
+        当てはめた床面の傾きが max_tilt_deg 度を超える場合や、床面の点が全体の min_inlier_ratio 未満の場合は
+        床面を正しく捉えられていないとみなしてRANSACに切り替える。
+        """
+        verbose = self.verbose if verbose is None else verbose
         if self.point_cloud is None:
             return False
         
@@ -104,15 +190,25 @@ class PointCloudProcessor:
                 print("点群が少なすぎて平面除去できません")
             return False
         
-        # 再現性のため、処理前に再度シードを設定
-        np.random.seed(42)
-        
-        # RANSAC平面検出（1回のみ実行）
-        plane_model, inliers = remaining_cloud.segment_plane(
-            distance_threshold=distance_threshold,
-            ransac_n=ransac_n,
-            num_iterations=num_iterations
-        )
+        use_ransac = True
+        if fast:
+            plane_model, inliers = self.detect_floor_plane(distance_threshold)
+            tilt_deg = np.degrees(np.arccos(min(abs(plane_model[1]), 1.0)))
+            use_ransac = tilt_deg > max_tilt_deg or len(inliers) < min_inlier_ratio * len(remaining_cloud.points)
+            if use_ransac and verbose:
+                print(f"床面を検出できないため（傾き {tilt_deg:.2f}度、{len(inliers)}点）、RANSACで再検出します")
+        
+        if use_ransac:
+            # 再現性のため、処理前に再度シードを設定（RANSACはOpen3Dの内部乱数を使う）
+            o3d.utility.random.seed(42)
+            
+            # RANSAC平面検出（1回のみ実行、反復はOpen3D内部でOpenMPにより並列評価される）
+            # テンソルAPI版は速いが、検出される平面がずれて寸法が大きく変わるため使わない
+            plane_model, inliers = remaining_cloud.segment_plane(
+                distance_threshold=distance_threshold,
+                ransac_n=ransac_n,
+                num_iterations=num_iterations
+            )
         
         if verbose:
             print(f"検出された平面のパラメータ: {plane_model}")
@@ -131,21 +227,77 @@ class PointCloudProcessor:
         self.point_cloud = remaining_cloud
         return True
     
+    @staticmethod
+    def _densest_band(heights, distance_threshold, bins_per_threshold=20, max_bins=1 << 20):
+        """幅 2*distance_threshold の区間のうち最も多くの値を含むものの中心を返す
+
+        細かいビンで点数を数え、累積和からスライディングウィンドウ内の点数を求める。
+        遠く離れた外れ値があってもビン数が max_bins を超えないよう、ビン幅は値の範囲に応じて広げる。
+        """
+        h_min = heights.min()
+        bin_width = max(distance_threshold / bins_per_threshold, (heights.max() - h_min) / max_bins)
+        counts = np.bincount(((heights - h_min) / bin_width).astype(np.intp))
+        cumulative = np.concatenate(([0], np.cumsum(counts)))
+        window = min(max(1, round(2 * distance_threshold / bin_width)), len(counts))
+        best = np.argmax(cumulative[window:] - cumulative[:-window])
+        return h_min + (best + window / 2) * bin_width
+    
+    def detect_floor_plane(self, distance_threshold=1.0, refine_iterations=3):
+        """Y座標のヒストグラムと最小二乗の当てはめで床面を検出（Y軸反転後に使う）
 
+        まずY座標で幅 2*distance_threshold の最も点の多い区間を床面の候補とし、
+        その点に平面 y = ax + cz + d を最小二乗で当てはめる。当てはめた平面の法線方向の高さで
+        同じように最も点の多い区間を選び直し、これを繰り返して床面の傾きを推定する
+        （RANSACが最大化するインライア数と同じ基準）。
+        足は床面の上にあるため、床面より下の点も床面の点として扱う。
+
+        Returns:
+            tuple: (平面のパラメータ [a, b, c, d], 平面に属する点のインデックス)
+        """
+        points = self.coords
+        plane_model = np.array([0.0, 1.0, 0.0, 0.0])
+        
+        for iteration in range(refine_iterations + 1):
+            # 現在の法線方向の高さで、最も点の多い区間を床面の点とする
+            heights = points @ plane_model[:3]
+            offset = self._densest_band(heights, distance_threshold)
+            plane_model[3] = -offset
+            if iteration == refine_iterations:
+                inliers = np.flatnonzero(heights - offset <= distance_threshold)
+                break
+            inliers = np.flatnonzero(np.abs(heights - offset) <= distance_threshold)
+            if len(inliers) < 3:
+                break
+            
+            # 床面の点に y = ax + cz + d を最小二乗で当てはめ、法線を更新
+            floor_points = points[inliers]
+            design = np.column_stack((floor_points[:, 0], floor_points[:, 2], np.ones(len(inliers))))
+            (a, c, _), *_ = np.linalg.lstsq(design, floor_points[:, 1], rcond=None)
+            normal = np.array([-a, 1.0, -c])
+            plane_model[:3] = normal / np.linalg.norm(normal)
+        
+        # 床面を ax + by + cz + d = 0 の形式で表す
+        return plane_model, inliers
     
-    def align_to_principal_component(self, verbose=True):
+    def align_to_principal_component(self, verbose=None):
         """主成分方向をXZ平面に投影してX軸方向に整列"""
+        verbose = self.verbose if verbose is None else verbose
         if self.point_cloud is None:
             return False
         
-        points = np.asarray(self.point_cloud.points)
+        points = self.coords
         
-        # 全ての点で主成分分析
-        pca = PCA(n_components=3)
-        pca.fit(points)
+        # 全ての点で主成分分析（3x3共分散行列の固有値分解）
+        # 中心化した (N, 3) のコピーを作らず、E[XX^T] - μμ^T として共分散を求める
+        mean = points.mean(axis=0)
+        covariance = points.T @ points / len(points) - np.outer(mean, mean)
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
         
         # 第1主成分（最大分散方向）を取得
-        principal_component = pca.components_[0]
+        principal_component = eigenvectors[:, np.argmax(eigenvalues)]
+        # 固有ベクトルの符号は不定なので、sklearnのPCAと同じく絶対値最大の成分が正になる向きに揃える
+        if principal_component[np.argmax(np.abs(principal_component))] < 0:
+            principal_component = -principal_component
         if verbose:
             print(f"元の第1主成分ベクトル: {principal_component}")
         
@@ -159,34 +311,26 @@ class PointCloudProcessor:
                 print(f"XZ平面に投影された主成分ベクトル: {projected_component}")
             
             # XZ平面上でX軸ベクトル [1, 0, 0] に合わせる
-            x_axis = np.array([1, 0, 0])
-            
-            # XZ平面上での回転角度を計算
-            # cos(θ) = dot(projected_component, x_axis)
-            cos_angle = np.dot(projected_component, x_axis)
-            cos_angle = np.clip(cos_angle, -1.0, 1.0)
-            angle = np.arccos(cos_angle)
-            
-            # XZ平面上での回転方向を決定（Y軸周りの回転）
-            # 外積の Y 成分の符号で回転方向を決める
-            cross_product = np.cross(projected_component, x_axis)
-            # XZ平面上の2つのベクトルの外積のY成分を取得
-            if cross_product[1] < 0:  # 時計回り
-                angle = -angle
+            # 投影ベクトルは単位ベクトルなので、Y軸周りの回転角θについて
+            # cos(θ) = X成分、sin(θ) = Z成分（外積のY成分と同符号）がそのまま得られる
+            cos_angle, sin_angle = projected_component[0], projected_component[2]
             
             if verbose:
-                print(f"Y軸周りの回転角度: {np.degrees(angle):.2f}度")
+                print(f"Y軸周りの回転角度: {np.degrees(np.arctan2(sin_angle, cos_angle)):.2f}度")
             
             # Y軸周りの回転行列を作成
             rotation_matrix = np.array([
-                [np.cos(angle), 0, np.sin(angle)],
+                [cos_angle, 0, sin_angle],
                 [0, 1, 0],
-                [-np.sin(angle), 0, np.cos(angle)]
+                [-sin_angle, 0, cos_angle]
             ])
             
-            # 点群を回転
-            rotated_points = points @ rotation_matrix.T
-            self.point_cloud.points = o3d.utility.Vector3dVector(rotated_points)
+            # 点群を回転（np.asarrayはOpen3Dのバッファのビューなので、結果をその場で書き戻す）
+            # 入力と出力が重なるmatmulは内部で一時配列を確保するため、点と法線で共用の作業領域を使う
+            rotation_t = np.ascontiguousarray(rotation_matrix.T)
+            work = np.empty_like(points)
+            np.matmul(points, rotation_t, out=work)
+            points[...] = work
             
             # 色情報がある場合は保持
             if self.point_cloud.has_colors():
@@ -195,16 +339,19 @@ class PointCloudProcessor:
             # 法線情報がある場合は回転
             if self.point_cloud.has_normals():
                 normals = np.asarray(self.point_cloud.normals)
-                rotated_normals = normals @ rotation_matrix.T
-                self.point_cloud.normals = o3d.utility.Vector3dVector(rotated_normals)
+                np.matmul(normals, rotation_t, out=work)
+                normals[...] = work
+            
+            self._invalidate_point_cache()
         else:
             if verbose:
                 print("主成分のXZ投影が無効なため、回転をスキップします")
         
         return True
     
-    def remove_noise(self, nb_neighbors=30, std_ratio=0.5, verbose=True):
+    def remove_noise(self, nb_neighbors=30, std_ratio=0.5, nb_points=10, radius=2.0, verbose=None):
         """統計的外れ値除去によるノイズ除去（強め、再現性確保）"""
+        verbose = self.verbose if verbose is None else verbose
         if self.point_cloud is None:
             return False
         
@@ -215,22 +362,24 @@ class PointCloudProcessor:
             print(f"ノイズ除去前の点数: {len(self.point_cloud.points)}")
         
         # 統計的外れ値除去（より強力な設定）
-        cl, ind = self.point_cloud.remove_statistical_outlier(
+        # 戻り値の点群は選別済みなので、インデックスから選び直さずにそのまま使う
+        self.point_cloud, _ = self.point_cloud.remove_statistical_outlier(
             nb_neighbors=nb_neighbors,  # 隣接点数を増加（20→30）
             std_ratio=std_ratio  # 標準偏差の閾値を下げる（1.0→0.5）
         )
-        
-        self.point_cloud = self.point_cloud.select_by_index(ind)
         if verbose:
             print(f"ノイズ除去後の点数: {len(self.point_cloud.points)}")
         
         # さらに半径ベースの外れ値除去も追加
+        # remove_radius_outlierは半径内の全近傍を列挙するため遅い。
+        # 「半径内に自身以外nb_points点以上ある」は「nb_points番目の近傍が半径内にある」と同値なので、
+        # k近傍探索（自身を含めk=nb_points+1）の最遠距離だけで判定する（探索はself.workersスレッドで並列実行）
         if verbose:
             print("半径ベースの外れ値除去を実行中...")
-        cl2, ind2 = self.point_cloud.remove_radius_outlier(
-            nb_points=10,  # 半径内に最低10点必要
-            radius=2.0     # 半径2cm（センチメートル単位）
-        )
+        from scipy.spatial import cKDTree
+        points = self.coords
+        distances, _ = cKDTree(points).query(points, k=nb_points + 1, distance_upper_bound=radius, workers=self.workers)
+        ind2 = np.flatnonzero(np.isfinite(distances[:, -1]))  # 半径外の近傍はinfになる
         
         self.point_cloud = self.point_cloud.select_by_index(ind2)
         if verbose:
@@ -238,23 +387,22 @@ class PointCloudProcessor:
         
         return True
     
-    def calculate_foot_dimensions(self, verbose=True):
+    def calculate_foot_dimensions(self, verbose=None):
         """足の長さ、幅、周囲長、甲高@50%、AHIを計算"""
+        verbose = self.verbose if verbose is None else verbose
         if self.point_cloud is None:
             return None, None, None, None, None
         
-        points = np.asarray(self.point_cloud.points)
+        (x_min, _, z_min), (x_max, _, z_max) = self._point_extents()
         
         # X軸方向の範囲（足の長さ）
-        x_min, x_max = points[:, 0].min(), points[:, 0].max()
-        foot_length = abs(x_max - x_min)
+        foot_length = float(abs(x_max - x_min))
         
         # 切断足長（truncated foot length）を計算（通常の足長と同じ）
         truncated_foot_length = foot_length
         
         # Z軸方向の範囲（足の幅）
-        z_min, z_max = points[:, 2].min(), points[:, 2].max()
-        foot_width = abs(z_max - z_min)
+        foot_width = float(abs(z_max - z_min))
         
         # 周囲長計算：各X座標でZ座標の差が最大となる位置を見つける
         circumference = self.calculate_circumference_at_max_z_range(verbose)
@@ -282,12 +430,14 @@ class PointCloudProcessor:
         
         return foot_length, foot_width, circumference, dorsum_height_50, ahi
     
-    def calculate_circumference_at_max_z_range(self, verbose=True):
+    def calculate_circumference_at_max_z_range(self, verbose=None):
         """Z座標の差が最大となるX位置でYZ平面の断面周囲長を計算し、その断面点を赤色に染める"""
-        points = np.asarray(self.point_cloud.points)
+        verbose = self.verbose if verbose is None else verbose
+        points = self.coords
+        x, _, z = self._point_columns()
         
         # X座標を一定間隔で区切って、各区間でZ座標の範囲を計算
-        x_min, x_max = points[:, 0].min(), points[:, 0].max()
+        (x_min, _, _), (x_max, _, _) = self._point_extents()
         num_slices = 50  # X方向の分割数
         x_bins = np.linspace(x_min, x_max, num_slices + 1)
         
@@ -295,16 +445,21 @@ class PointCloudProcessor:
         best_x_pos = None
         
         # 各X区間でZ座標の範囲を計算
-        for i in range(num_slices):
-            x_start, x_end = x_bins[i], x_bins[i + 1]
-            mask = (points[:, 0] >= x_start) & (points[:, 0] <= x_end)
-            slice_points = points[mask]
-            
-            if len(slice_points) > 0:
-                z_range = slice_points[:, 2].max() - slice_points[:, 2].min()
-                if z_range > max_z_range:
-                    max_z_range = z_range
-                    best_x_pos = (x_start + x_end) / 2
+        # 点をX座標でソートしておけば、各区間は連続した範囲になり境界は二分探索で求まる
+        # 空でない区間ごとのZの最小・最大をreduceatでまとめて求める
+        order = np.argsort(x)
+        x_sorted = x[order]
+        z_sorted = z[order]
+        bounds = np.concatenate(([0], np.searchsorted(x_sorted, x_bins[1:-1]), [len(x_sorted)]))
+        occupied_bins = np.flatnonzero(np.diff(bounds))
+        starts = bounds[occupied_bins]
+        z_ranges = np.maximum.reduceat(z_sorted, starts) - np.minimum.reduceat(z_sorted, starts)
+        
+        best = np.argmax(z_ranges)  # 同じ範囲の区間が複数ある場合はX座標が小さい方
+        if z_ranges[best] > max_z_range:
+            max_z_range = z_ranges[best]
+            best_bin = occupied_bins[best]
+            best_x_pos = (x_bins[best_bin] + x_bins[best_bin + 1]) / 2
         
         if best_x_pos is None:
             if verbose:
@@ -316,9 +471,10 @@ class PointCloudProcessor:
         
         # 最適なX位置での断面点を抽出（幅を少し広げて十分な点を確保）
         slice_width = (x_max - x_min) / num_slices * 1.5  # 少し幅を広げる
-        mask = (points[:, 0] >= best_x_pos - slice_width/2) & (points[:, 0] <= best_x_pos + slice_width/2)
-        cross_section_points = points[mask]
-        cross_section_indices = np.where(mask)[0]
+        lo = np.searchsorted(x_sorted, best_x_pos - slice_width/2, side='left')
+        hi = np.searchsorted(x_sorted, best_x_pos + slice_width/2, side='right')
+        cross_section_indices = np.sort(order[lo:hi])  # 元の点の並び順に戻す
+        cross_section_points = points[cross_section_indices]
         
         if len(cross_section_points) < 3:
             if verbose:
@@ -334,28 +490,15 @@ class PointCloudProcessor:
         # 2D凸包を計算して周囲長を求める
         try:
             from scipy.spatial import ConvexHull
-            # 再現性のため、処理前にシードを設定
-            np.random.seed(42)
-            
-            # 点群をソートして処理順序を安定化
-            sorted_indices = np.lexsort((yz_points[:, 1], yz_points[:, 0]))
-            yz_points_sorted = yz_points[sorted_indices]
             
-            hull = ConvexHull(yz_points_sorted)
+            hull = ConvexHull(yz_points)
             
-            # 凸包の頂点を順序に従って取得
-            hull_points = yz_points_sorted[hull.vertices]
-            
-            # 周囲長を計算
-            circumference = 0.0
-            for i in range(len(hull_points)):
-                p1 = hull_points[i]
-                p2 = hull_points[(i + 1) % len(hull_points)]
-                circumference += np.linalg.norm(p2 - p1)
+            # 2次元の凸包ではareaが周囲長（volumeが面積）になる
+            circumference = float(hull.area)
             
             if verbose:
                 print(f"凸包による周囲長: {circumference:.3f}")
-                print(f"凸包頂点数: {len(hull_points)}")
+                print(f"凸包頂点数: {len(hull.vertices)}")
             
             # 断面の点を赤色に染める
             self.color_cross_section_points(cross_section_indices, verbose)
@@ -372,8 +515,9 @@ class PointCloudProcessor:
                 print(f"凸包計算エラー: {e}")
             return self.calculate_simple_circumference(yz_points, cross_section_indices, verbose)
     
-    def calculate_simple_circumference(self, yz_points, cross_section_indices, verbose=True):
+    def calculate_simple_circumference(self, yz_points, cross_section_indices, verbose=None):
         """簡易的な周囲長計算（scipyが無い場合、再現性確保）"""
+        verbose = self.verbose if verbose is None else verbose
         # 再現性のため、処理前にシードを設定
         np.random.seed(42)
         
@@ -384,6 +528,7 @@ class PointCloudProcessor:
         angles = np.arctan2(yz_points[:, 1] - center[1], yz_points[:, 0] - center[0])
         sorted_indices = np.argsort(angles)
         sorted_points = yz_points[sorted_indices]
+        sorted_angles = angles[sorted_indices]
         
         # 外周の点のみを抽出（距離ベース）
         distances = np.linalg.norm(sorted_points - center, axis=1)
@@ -391,29 +536,24 @@ class PointCloudProcessor:
         # 角度を一定間隔で区切って、各区間で最も遠い点を選択
         num_sectors = 20
         angle_bins = np.linspace(-np.pi, np.pi, num_sectors + 1)
-        perimeter_points = []
-        
-        for i in range(num_sectors):
-            angle_start, angle_end = angle_bins[i], angle_bins[i + 1]
-            mask = (angles >= angle_start) & (angles < angle_end)
-            if np.any(mask):
-                sector_distances = distances[mask]
-                max_dist_idx = np.argmax(sector_distances)
-                sector_indices = np.where(mask)[0]
-                perimeter_points.append(yz_points[sector_indices[max_dist_idx]])
-        
-        if len(perimeter_points) < 3:
-            print("外周点が不足しています")
+        # 各点の区間番号（角度がちょうどπの点はどの区間にも含めない）
+        sectors = np.searchsorted(angle_bins, sorted_angles, side='right') - 1
+        
+        # 区間番号順・距離の降順に並べ替え、各区間の先頭（最も遠い点）をまとめて取り出す
+        order = np.lexsort((-distances, sectors))
+        _, first_in_sector = np.unique(sectors[order], return_index=True)
+        farthest = order[first_in_sector]
+        farthest = farthest[sectors[farthest] < num_sectors]
+        
+        if len(farthest) < 3:
+            if verbose:
+                print("外周点が不足しています")
             return 0.0
         
-        perimeter_points = np.array(perimeter_points)
+        perimeter_points = sorted_points[farthest]
         
         # 周囲長を計算
-        circumference = 0.0
-        for i in range(len(perimeter_points)):
-            p1 = perimeter_points[i]
-            p2 = perimeter_points[(i + 1) % len(perimeter_points)]
-            circumference += np.linalg.norm(p2 - p1)
+        circumference = polygon_perimeter(perimeter_points)
         
         if verbose:
             print(f"簡易計算による周囲長: {circumference:.3f}")
@@ -423,32 +563,33 @@ class PointCloudProcessor:
         
         return circumference
     
-    def color_cross_section_points(self, cross_section_indices, verbose=True):
+    def color_cross_section_points(self, cross_section_indices, verbose=None):
         """指定されたインデックスの点を赤色に染める"""
+        verbose = self.verbose if verbose is None else verbose
         if not self.point_cloud.has_colors():
             # 色情報がない場合は全点にデフォルト色を設定
-            points = np.asarray(self.point_cloud.points)
-            colors = np.ones((len(points), 3)) * 0.7  # デフォルトグレー
+            colors = np.full((len(self.point_cloud.points), 3), 0.7)  # デフォルトグレー
             self.point_cloud.colors = o3d.utility.Vector3dVector(colors)
         
+        # np.asarrayはOpen3Dのバッファのビューなので、その場で塗り替える
         colors = np.asarray(self.point_cloud.colors)
         
         # 断面の点を赤色に設定
         colors[cross_section_indices] = [1.0, 0.0, 0.0]  # 赤色
         
-        self.point_cloud.colors = o3d.utility.Vector3dVector(colors)
         if verbose:
             print(f"断面の点 {len(cross_section_indices)} 個を赤色に染色しました")
 
-    def calculate_arch_height_index(self, foot_length, truncated_foot_length, verbose=True):
+    def calculate_arch_height_index(self, foot_length, truncated_foot_length, verbose=None):
         """甲高@50%とAHI（Arch Height Index）を計算"""
+        verbose = self.verbose if verbose is None else verbose
         if self.point_cloud is None:
             return None, None
         
-        points = np.asarray(self.point_cloud.points)
+        x, y, _ = self._point_columns()
+        (x_min, y_min, _), _ = self._point_extents()
         
         # 足長の50%位置を計算
-        x_min, x_max = points[:, 0].min(), points[:, 0].max()
         x_50_percent = x_min + 0.5 * foot_length
         
         if verbose:
@@ -456,25 +597,23 @@ class PointCloudProcessor:
         
         # X = 50%位置での直交スライス平面を生成（Xに直交）
         slice_width = foot_length * 0.02  # 足長の2%の幅で断面を取る
-        mask = (points[:, 0] >= x_50_percent - slice_width/2) & (points[:, 0] <= x_50_percent + slice_width/2)
-        slice_points = points[mask]
+        mask = (x >= x_50_percent - slice_width/2) & (x <= x_50_percent + slice_width/2)
         slice_indices = np.where(mask)[0]
         
-        if len(slice_points) < 3:
+        if len(slice_indices) < 3:
             if verbose:
                 print("50%位置での断面点が不足しています")
             return 0.0, 0.0
         
         if verbose:
-            print(f"50%位置断面の点数: {len(slice_points)}")
+            print(f"50%位置断面の点数: {len(slice_indices)}")
         
         # スライスで得た断面点群の最大Z（背側高さ）を取得
-        # Y軸の最小値を足底平面として扱う
-        y_min = points[:, 1].min()  # 全体の足底平面
-        slice_y_max = slice_points[:, 1].max()  # 断面での最大高さ（背側）
+        # Y軸の最小値（y_min、点群全体）を足底平面として扱う
+        slice_y_max = y[slice_indices].max()  # 断面での最大高さ（背側）
         
         # 甲高@50% = 断面での最大高さ - 足底平面の高さ
-        dorsum_height_50 = slice_y_max - y_min
+        dorsum_height_50 = float(slice_y_max - y_min)
         
         # AHI（Arch Height Index）を計算
         # AHI = dorsum_height@50% / truncated_foot_length
@@ -491,20 +630,20 @@ class PointCloudProcessor:
         
         return dorsum_height_50, ahi
     
-    def color_arch_slice_points(self, slice_indices, verbose=True):
+    def color_arch_slice_points(self, slice_indices, verbose=None):
         """甲高@50%測定に使用した断面の点を青色に染める"""
+        verbose = self.verbose if verbose is None else verbose
         if not self.point_cloud.has_colors():
             # 色情報がない場合は全点にデフォルト色を設定
-            points = np.asarray(self.point_cloud.points)
-            colors = np.ones((len(points), 3)) * 0.7  # デフォルトグレー
+            colors = np.full((len(self.point_cloud.points), 3), 0.7)  # デフォルトグレー
             self.point_cloud.colors = o3d.utility.Vector3dVector(colors)
         
+        # np.asarrayはOpen3Dのバッファのビューなので、その場で塗り替える
         colors = np.asarray(self.point_cloud.colors)
         
         # 50%位置断面の点を青色に設定
         colors[slice_indices] = [0.0, 0.0, 1.0]  # 青色
         
-        self.point_cloud.colors = o3d.utility.Vector3dVector(colors)
         if verbose:
             print(f"甲高@50%測定断面の点 {len(slice_indices)} 個を青色に染色しました")
 
@@ -516,12 +655,37 @@ class PointCloudProcessor:
         output_path = os.path.join(output_dir, filename)
         
         try:
-            success = o3d.io.write_point_cloud(output_path, self.point_cloud)
-            return success
+            PlyData([PlyElement.describe(self._vertex_array(), 'vertex')], text=False, byte_order='<').write(output_path)
+            return True
         except Exception as e:
             return False
 
-def process_ply_file(input_file_path, output_file_path=None, verbose=True):
+    def _vertex_array(self):
+        """保存用の頂点配列（座標・法線はfloat32、色はuchar）を構造化配列として作成
+
+        座標は寸法計算で使ったfloat32の列キャッシュをそのまま書き出すので、
+        Open3Dの書き出しのようなdouble変換が不要になり、ファイルサイズも小さくなる。
+        """
+        fields = [('x', 'f4'), ('y', 'f4'), ('z', 'f4')]
+        if self.point_cloud.has_normals():
+            fields += [(name, 'f4') for name in NORMAL_FIELDS]
+        if self.point_cloud.has_colors():
+            fields += [('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
+        
+        vertices = np.empty(len(self.point_cloud.points), dtype=fields)
+        for name, column in zip(('x', 'y', 'z'), self._point_columns()):
+            vertices[name] = column
+        if self.point_cloud.has_normals():
+            normals = np.asarray(self.point_cloud.normals)
+            for axis, name in enumerate(NORMAL_FIELDS):
+                vertices[name] = normals[:, axis]
+        if self.point_cloud.has_colors():
+            colors = np.rint(np.clip(np.asarray(self.point_cloud.colors), 0.0, 1.0) * 255).astype(np.uint8)
+            for axis, name in enumerate(('red', 'green', 'blue')):
+                vertices[name] = colors[:, axis]
+        return vertices
+
+def process_ply_file(input_file_path, output_file_path=None, verbose=True, fast_plane_removal=False, downsample_voxel=None, workers=-1):
     """
     PLYファイルを処理して足の寸法を測定
     
@@ -529,6 +693,9 @@ def process_ply_file(input_file_path, output_file_path=None, verbose=True):
         input_file_path (str): 入力PLYファイルのパス
         output_file_path (str): 出力PLYファイルのパス（Noneの場合は自動生成）
         verbose (bool): 詳細ログの表示
+        fast_plane_removal (bool): 床面除去にRANSACの代わりにヒストグラムと最小二乗による検出を使用（床面がほぼ水平な場合）
+        downsample_voxel (float): 読み込み直後にダウンサンプリングするボクセルサイズ（cm、Noneの場合は行わない）
+        workers (int): 近傍探索のスレッド数（-1は全コア、プロセスプールから並列に呼ぶ場合は1）
     
     Returns:
         dict: 処理結果 {
@@ -539,13 +706,13 @@ def process_ply_file(input_file_path, output_file_path=None, verbose=True):
             'point_count': int
         }
     """
-    processor = PointCloudProcessor()
+    processor = PointCloudProcessor(verbose=verbose, workers=workers)
     
     try:
         # PLYファイルを読み込み
         if verbose:
             print("PLYファイルを読み込み中...")
-        result = processor.load_ply_file(input_file_path, verbose)
+        result = processor.load_ply_file(input_file_path)
         if not result:
             return {
                 'success': False,
@@ -563,26 +730,31 @@ def process_ply_file(input_file_path, output_file_path=None, verbose=True):
             print(f"点群が正常に読み込まれました。点数: {len(processor.point_cloud.points)}")
         
         # 処理の実行
+        if downsample_voxel:
+            if verbose:
+                print("ダウンサンプリング中...")
+            processor.downsample(downsample_voxel)
+        
         if verbose:
             print("Y軸を反転中...")
         processor.flip_y_axis()
         
         if verbose:
             print("主要な平面を除去中...")
-        processor.remove_planes(verbose=verbose)
+        processor.remove_planes(fast=fast_plane_removal)
         
         if verbose:
             print("主成分軸に整列中...")
-        processor.align_to_principal_component(verbose)
+        processor.align_to_principal_component()
         
         if verbose:
             print("ノイズ除去中...")
-        processor.remove_noise(verbose=verbose)
+        processor.remove_noise()
         
         # 足の寸法を計算
         if verbose:
             print("足の寸法を計算中...")
-        foot_length, foot_width, circumference, dorsum_height_50, ahi = processor.calculate_foot_dimensions(verbose)
+        foot_length, foot_width, circumference, dorsum_height_50, ahi = processor.calculate_foot_dimensions()
         
         # 結果を保存
         if output_file_path is None:
@@ -1,9 +1,29 @@
 import random
 import time
 import os
-from plyfile import PlyData
 
-def analyze_foot_shoe_match(foot_file_path, shoe_file_path, verbose=True):
+def count_ply_vertices(file_path):
+    """
+    PLYファイルのヘッダーだけを読んで頂点数を返す（本体のデータは読み込まない）
+    
+    Args:
+        file_path (str): PLYファイルパス
+    
+    Returns:
+        int: 頂点数
+    """
+    with open(file_path, 'rb') as f:
+        if f.readline().strip() != b'ply':
+            raise ValueError(f"PLYファイルではありません: {file_path}")
+        for line in f:
+            fields = line.split()
+            if fields[:2] == [b'element', b'vertex']:
+                return int(fields[2])
+            if fields[:1] == [b'end_header']:
+                break
+    raise ValueError(f"vertex要素が見つかりません: {file_path}")
+
+def analyze_foot_shoe_match(foot_file_path, shoe_file_path, verbose=True, simulate_latency=False):
     """
     足と靴の一致度を解析する（ダミー実装）
     
@@ -11,6 +31,7 @@ def analyze_foot_shoe_match(foot_file_path, shoe_file_path, verbose=True):
         foot_file_path (str): 足のPLYファイルパス
         shoe_file_path (str): 靴のPLYファイルパス
         verbose (bool): 詳細ログの表示
+        simulate_latency (bool): 実際の処理時間をsleepで模擬する（デモ用）
     
     Returns:
         dict: 解析結果 {
@@ -24,11 +45,8 @@ def analyze_foot_shoe_match(foot_file_path, shoe_file_path, verbose=True):
     
     try:
         # PLYファイルの基本情報を取得
-        foot_data = PlyData.read(foot_file_path)
-        shoe_data = PlyData.read(shoe_file_path)
-        
-        foot_points = len(foot_data['vertex'])
-        shoe_points = len(shoe_data['vertex'])
+        foot_points = count_ply_vertices(foot_file_path)
+        shoe_points = count_ply_vertices(shoe_file_path)
         
         if verbose:
             print(f"足の点群数: {foot_points}")
@@ -37,15 +55,18 @@ def analyze_foot_shoe_match(foot_file_path, shoe_file_path, verbose=True):
         # ダミー解析処理（実際の処理のシミュレーション）
         if verbose:
             print("寸法比較を実行中...")
-        time.sleep(0.5)  # 処理時間のシミュレーション
+        if simulate_latency:
+            time.sleep(0.5)  # 処理時間のシミュレーション
         
         if verbose:
             print("形状マッチングを実行中...")
-        time.sleep(0.5)
+        if simulate_latency:
+            time.sleep(0.5)
         
         if verbose:
             print("圧力分布解析を実行中...")
-        time.sleep(0.3)
+        if simulate_latency:
+            time.sleep(0.3)
         
         # ダミーの解析結果を生成
         # 実際の実装では、ここで複雑な3D解析を行う